@@ -40,6 +40,7 @@ import shutil
 import subprocess
 import platform
 import argparse
+import functools
 from pathlib import Path
 
 class ChromeExtensionDebugger:
@@ -48,9 +49,12 @@ class ChromeExtensionDebugger:
         self.extension_dir = Path(__file__).parent.parent / "chrome"
         self.temp_profile = None
         self.chrome_process = None
+        self._chrome_path = None
         
-    def find_chrome(self):
-        """Find Chrome executable based on platform"""
+    @staticmethod
+    @functools.lru_cache(maxsize=1)
+    def find_chrome():
+        """Find Chrome executable based on platform (cached for the process)"""
         system = platform.system()
         
         chrome_paths = {
@@ -72,25 +76,48 @@ class ChromeExtensionDebugger:
             ]
         }
         
-        for path in chrome_paths.get(system, []):
-            if os.path.exists(path):
-                return path
+        path = next((p for p in chrome_paths.get(system, ()) if Path(p).is_file()), None)
+        if path:
+            return path
                 
         # Try to find in PATH
         for cmd in ['google-chrome', 'google-chrome-stable', 'chromium', 'chrome']:
-            if shutil.which(cmd):
-                return cmd
+            path = shutil.which(cmd)
+            if path:
+                return path
                 
         raise Exception("Chrome not found. Please install Google Chrome.")
         
     def build_extension(self):
-        """Build the extension if needed"""
+        """Start building the extension if needed, returning the build process"""
         background_js = self.extension_dir / "dist" / "background.bundle.js"
-        if not background_js.exists():
-            print("📦 Building extension...")
-            subprocess.run(["npm", "run", "build"], 
-                         cwd=self.extension_dir.parent, 
-                         check=True)
+        if background_js.exists():
+            return None
+            
+        print("📦 Building extension...")
+        return subprocess.Popen(["npm", "run", "build"],
+                              cwd=self.extension_dir.parent)
+        
+    def wait_for_build(self, build_proc):
+        """Wait for a build started by build_extension to finish"""
+        if build_proc is None:
+            return
+            
+        returncode = build_proc.wait()
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, build_proc.args)
+            
+    def stop_build(self, build_proc):
+        """Stop a background build that is still running"""
+        if build_proc is None or build_proc.poll() is not None:
+            return
+            
+        build_proc.terminate()
+        try:
+            build_proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            build_proc.kill()
+            build_proc.wait()
             
     def create_debug_profile(self, keep_profile=False):
         """Create a temporary Chrome profile for debugging"""
@@ -102,34 +129,30 @@ class ChromeExtensionDebugger:
             self.temp_profile = tempfile.mkdtemp(prefix="pkm-chrome-debug-")
             return self.temp_profile
             
-    def launch_chrome(self, args):
+    def launch_chrome(self, args, build_proc=None):
         """Launch Chrome with debugging options"""
-        chrome_path = self.find_chrome()
+        # Resolve Chrome and the profile while a pending build runs
+        if self._chrome_path is None:
+            self._chrome_path = self.find_chrome()
+        chrome_path = self._chrome_path
         profile_dir = self.create_debug_profile(args.keep_profile)
         
+        # The extension must be built before Chrome loads it
+        self.wait_for_build(build_proc)
+        
         chrome_args = [
             chrome_path,
             f'--user-data-dir={profile_dir}',
             f'--load-extension={self.extension_dir}',
             '--no-first-run',
             '--no-default-browser-check',
+            *(['--auto-open-devtools-for-tabs'] if args.auto_devtools else ()),
+            *(['--headless=new'] if args.headless else ()),
+            *(['--enable-logging', '--v=1'] if args.verbose else ()),
+            # Starting URL
+            args.url or 'chrome://extensions',
         ]
         
-        if args.auto_devtools:
-            chrome_args.append('--auto-open-devtools-for-tabs')
-            
-        if args.headless:
-            chrome_args.append('--headless=new')
-            
-        if args.verbose:
-            chrome_args.extend([
-                '--enable-logging',
-                '--v=1'
-            ])
-            
-        # Add starting URL
-        chrome_args.append(args.url or 'chrome://extensions')
-        
         print(f"🚀 Launching Chrome...")
         print(f"📁 Extension: {self.extension_dir}")
         print(f"🔧 Profile: {profile_dir}")
@@ -151,20 +174,30 @@ class ChromeExtensionDebugger:
         
     def check_server(self, port=5000):
         """Check if VS Code extension server is running"""
+        import errno
+        import select
         import socket
         try:
+            # Non-blocking probe of 127.0.0.1: no name lookup, and a refused
+            # connection on loopback is reported straight away
             sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(1)
-            result = sock.connect_ex(('localhost', port))
-            sock.close()
+            sock.setblocking(False)
+            try:
+                result = sock.connect_ex(('127.0.0.1', port))
+                if result not in (0, errno.EISCONN, errno.ECONNREFUSED):
+                    _, writable, _ = select.select([], [sock], [], 0.05)
+                    if writable:
+                        result = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            finally:
+                sock.close()
             
-            if result == 0:
-                print("✅ VS Code extension detected on port 5000")
+            if result in (0, errno.EISCONN):
+                print(f"✅ VS Code extension detected on port {port}")
                 return True
         except:
             pass
             
-        print("⚠️  VS Code extension not detected on port 5000")
+        print(f"⚠️  VS Code extension not detected on port {port}")
         print("   Make sure to run the VS Code extension from your IDE")
         return False
         
@@ -214,16 +247,17 @@ Examples:
     args = parser.parse_args()
     
     debugger = ChromeExtensionDebugger()
+    build_proc = None
     
     try:
-        # Build extension
-        debugger.build_extension()
+        # Start building the extension in the background
+        build_proc = debugger.build_extension()
         
         # Check for server
         debugger.check_server()
             
-        # Launch Chrome
-        process = debugger.launch_chrome(args)
+        # Launch Chrome once the build has finished
+        process = debugger.launch_chrome(args, build_proc)
         
         # Run tests if requested
         if args.test:
@@ -241,6 +275,8 @@ Examples:
         print(f"❌ Error: {e}")
         sys.exit(1)
     finally:
+        # Don't leave npm building in the background if we never got to Chrome
+        debugger.stop_build(build_proc)
         debugger.cleanup()
 
 if __name__ == '__main__':
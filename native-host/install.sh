@@ -108,7 +108,7 @@ fi
 
 # Install Python dependencies
 echo -e "${YELLOW}Installing Python dependencies...${NC}"
-pip3 install --user requests
+pip3 install --user orjson
 
 # Create Bergamot directory
 mkdir -p "$HOME/.bergamot"
@@ -131,4 +131,6 @@ echo "2. Restart your browsers for changes to take effect"
 echo ""
 echo "3. The native host logs can be found at:"
 echo "   ~/.bergamot/native-host.log"
+echo "   (set BERGAMOT_LOG_LEVEL=DEBUG in the browser's environment to log every message,"
+echo "   or BERGAMOT_LOW_LATENCY=1 to flush each reply immediately)"
 echo ""
\ No newline at end of file
@@ -2,77 +2,416 @@
 """
 Bergamot Native Messaging Host
 Bridges communication between browser extension and VS Code extension
+
+Environment (inherited from the browser that launches the host):
+  BERGAMOT_LOG_LEVEL=DEBUG   Log every message to ~/.bergamot/native-host.log
+  BERGAMOT_LOW_LATENCY=1     Flush each reply immediately instead of coalescing
+                             (same as passing --low-latency when run by hand)
 """
 
+import io
 import sys
-import json
 import os
+import time
+import atexit
+import socket
 import struct
-import requests
-import logging
+import threading
 from pathlib import Path
 
-# Configure logging
+# Prefer orjson for the per-message encode/decode; it works on bytes directly.
+# The stdlib fallback is wrapped so both expose the same bytes-in/bytes-out API.
+try:
+    import orjson as _json
+except ImportError:
+    import json
+
+    class _json:
+        @staticmethod
+        def dumps(obj):
+            return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+        @staticmethod
+        def loads(data):
+            return json.loads(bytes(data))
+
+class FastLog:
+    """Lightweight append-only logger for the per-message hot path.
+    
+    Records below the configured level cost a single comparison. Enabled
+    records are appended to a block-buffered file that is flushed on a short
+    timer, immediately on errors, and at exit. Once the file grows past
+    max_bytes it is rotated to a single .1 backup.
+    """
+    
+    DEBUG = 10
+    INFO = 20
+    WARNING = 30
+    ERROR = 40
+    
+    LEVELS = {'DEBUG': DEBUG, 'INFO': INFO, 'WARNING': WARNING, 'ERROR': ERROR}
+    _TAGS = {DEBUG: 'D', INFO: 'I', WARNING: 'W', ERROR: 'E'}
+    
+    def __init__(self, path, level=INFO, max_bytes=5 * 1024 * 1024, flush_interval=1.0):
+        self.path = Path(path)
+        self.level = level
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._timer = None
+        self.f = open(self.path, 'ab', buffering=65536)
+        self._rotate_at = max_bytes
+    
+    def _write(self, level, msg, args):
+        # Like logging.Handler.handleError, a failing log (disk full, file
+        # locked by another host) drops the record rather than reaching callers
+        try:
+            if args:
+                msg = msg % args
+            line = f"{time.time():.3f} {self._TAGS[level]} {msg}\n".encode('utf-8', 'replace')
+            
+            with self._lock:
+                self.f.write(line)
+                
+                if self.f.tell() >= self._rotate_at:
+                    self._rotate()
+                elif level >= self.ERROR:
+                    self._flush()
+                elif self._timer is None:
+                    self._timer = threading.Timer(self.flush_interval, self.flush)
+                    self._timer.daemon = True
+                    self._timer.start()
+        except (OSError, ValueError):
+            pass
+    
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self.f.flush()
+    
+    def _rotate(self):
+        self._flush()
+        self.f.close()
+        try:
+            os.replace(self.path, self.path.with_name(self.path.name + '.1'))
+        except OSError:
+            # Another host may hold the file open (e.g. on Windows); keep
+            # appending and only try again after another max_bytes
+            pass
+        finally:
+            self.f = open(self.path, 'ab', buffering=65536)
+            self._rotate_at = self.f.tell() + self.max_bytes
+    
+    def flush(self):
+        """Write buffered records to disk"""
+        try:
+            with self._lock:
+                self._flush()
+        except (OSError, ValueError):
+            pass
+    
+    def debug(self, msg, *args):
+        if self.level <= self.DEBUG:
+            self._write(self.DEBUG, msg, args)
+    
+    def info(self, msg, *args):
+        if self.level <= self.INFO:
+            self._write(self.INFO, msg, args)
+    
+    def warning(self, msg, *args):
+        if self.level <= self.WARNING:
+            self._write(self.WARNING, msg, args)
+    
+    def error(self, msg, *args):
+        if self.level <= self.ERROR:
+            self._write(self.ERROR, msg, args)
+
+# Configure logging; BERGAMOT_LOG_LEVEL=DEBUG enables per-message records
 log_dir = Path.home() / '.bergamot'
 log_dir.mkdir(exist_ok=True)
-logging.basicConfig(
-    filename=str(log_dir / 'native-host.log'),
-    level=logging.DEBUG,
-    format='%(asctime)s - %(levelname)s - %(message)s'
+_LOG = FastLog(
+    log_dir / 'native-host.log',
+    level=FastLog.LEVELS.get(os.environ.get('BERGAMOT_LOG_LEVEL', 'INFO').upper(), FastLog.INFO)
 )
+atexit.register(_LOG.flush)
+
+# Native messaging frame header: message length as a native-endian uint32
+_HDR = struct.Struct('@I')
+
+# Socket read timeouts: socket.timeout only became an alias of TimeoutError
+# in Python 3.10, so older interpreters need both
+_TIMEOUT_ERRORS = (TimeoutError, socket.timeout)
+
+# Keep-alive connection to the local VS Code server, one per thread since
+# forwards run on a worker pool and HTTPConnection is not thread-safe
+_CONNS = threading.local()
+
+# http.client (and the email package it pulls in) is imported on first use, so
+# hosts that only answer ping/get_port never pay for it
+_http_client = None
+
+# (connect, read) timeouts: connecting to localhost succeeds or fails almost
+# instantly, so only the read is given a generous window
+_FORWARD_TIMEOUT = (0.25, 5.0)
+_STATUS_TIMEOUT = (0.25, 2.0)
+
+# Forward replies are written from worker threads; keep each frame contiguous
+_WRITE_LOCK = threading.Lock()
+
+# Outgoing frames are coalesced and flushed once 4 KiB have accumulated or 2 ms
+# after the first unflushed frame. BERGAMOT_LOW_LATENCY=1 (or --low-latency)
+# flushes every message instead.
+_OUT_BUF = bytearray()
+_FLUSH_THRESHOLD = 4096
+_FLUSH_DELAY = 0.002
+_flush_timer = None
+_low_latency = os.environ.get('BERGAMOT_LOW_LATENCY', '').lower() in ('1', 'true', 'yes')
+
+# Unbuffered stdin, opened on first read, and the buffer every frame is read
+# into; the view over it is kept so reads don't create a new one each time
+_STDIN = None
+_READ_BUF = bytearray(65536)
+_READ_VIEW = memoryview(_READ_BUF)
+
+def _read_exact(n):
+    """Read exactly n bytes of stdin into the shared read buffer
+    
+    Returns a memoryview that is only valid until the next read, or None if
+    stdin closes first.
+    """
+    global _STDIN, _READ_BUF, _READ_VIEW
+    
+    if _STDIN is None:
+        _STDIN = io.FileIO(0, 'rb', closefd=False)
+    if n > len(_READ_BUF):
+        _READ_BUF = bytearray(n)
+        _READ_VIEW = memoryview(_READ_BUF)
+    
+    view = _READ_VIEW
+    got = 0
+    while got < n:
+        count = _STDIN.readinto(view[got:n])
+        if not count:
+            return None
+        got += count
+    return view[:n]
 
 def read_message():
     """Read a message from stdin using Chrome native messaging protocol"""
     try:
         # Read the message length (first 4 bytes)
-        raw_length = sys.stdin.buffer.read(4)
+        raw_length = _read_exact(4)
         if not raw_length:
-            logging.debug("No message length received, exiting")
+            _LOG.debug("No message length received, exiting")
             sys.exit(0)
         
-        message_length = struct.unpack('@I', raw_length)[0]
-        logging.debug(f"Message length: {message_length}")
-        
         # Read the message itself
-        message = sys.stdin.buffer.read(message_length).decode('utf-8')
-        logging.debug(f"Received message: {message}")
+        message_length = _HDR.unpack(raw_length)[0]
+        payload = _read_exact(message_length)
+        if payload is None:
+            _LOG.debug("Input closed mid-message, exiting")
+            sys.exit(0)
         
-        return json.loads(message)
+        message = _json.loads(payload)
+        _LOG.debug("Received message (%d bytes): %s", message_length, message)
+        return message
     except Exception as e:
-        logging.error(f"Error reading message: {e}")
+        _LOG.error(f"Error reading message: {e}")
         return None
 
-def send_message(message):
-    """Send a message to stdout using Chrome native messaging protocol"""
+def _flush_output():
+    """Write buffered frames to stdout; the caller must hold _WRITE_LOCK"""
+    global _flush_timer
+    
+    if _flush_timer is not None:
+        _flush_timer.cancel()
+        _flush_timer = None
+    
+    if _OUT_BUF:
+        sys.stdout.buffer.write(bytes(_OUT_BUF))
+        _OUT_BUF.clear()
+    sys.stdout.buffer.flush()
+
+def flush_output():
+    """Flush any frames still waiting in the output buffer"""
     try:
-        encoded = json.dumps(message).encode('utf-8')
-        
-        # Write message length
-        sys.stdout.buffer.write(struct.pack('@I', len(encoded)))
+        with _WRITE_LOCK:
+            _flush_output()
+    except Exception as e:
+        _LOG.error(f"Error flushing output: {e}")
+
+def send_message_raw(encoded):
+    """Send an already JSON-encoded message to stdout"""
+    global _flush_timer
+    
+    try:
+        # Header and payload are appended straight to the output buffer, so
+        # they leave in the same write without building an intermediate frame
+        header = _HDR.pack(len(encoded))
         
-        # Write the message
-        sys.stdout.buffer.write(encoded)
-        sys.stdout.buffer.flush()
+        with _WRITE_LOCK:
+            _OUT_BUF.extend(header)
+            _OUT_BUF.extend(encoded)
+            
+            if _low_latency or len(_OUT_BUF) >= _FLUSH_THRESHOLD:
+                _flush_output()
+            elif _flush_timer is None:
+                _flush_timer = threading.Timer(_FLUSH_DELAY, flush_output)
+                _flush_timer.daemon = True
+                _flush_timer.start()
         
-        logging.debug(f"Sent message: {message}")
+        _LOG.debug("Sent message: %s", encoded)
+    except Exception as e:
+        _LOG.error(f"Error sending message: {e}")
+
+def send_message(message):
+    """Send a message to stdout using Chrome native messaging protocol"""
+    try:
+        encoded = _json.dumps(message)
     except Exception as e:
-        logging.error(f"Error sending message: {e}")
+        _LOG.error(f"Error sending message: {e}")
+        return
+    
+    send_message_raw(encoded)
+
+# Binary port file written by the VS Code extension: magic + uint16 LE port
+_PORT_BIN_MAGIC = b'BGP1'
+_PORT_BIN = struct.Struct('<4sH')
+
+# Last parsed port file, keyed by path and mtime so a stat is enough on a hit
+_PORT_CACHE = {'path': None, 'mtime': None, 'port': 5000}
+
+# (mtime, size) of each port file that failed to parse, so a bad file is
+# skipped (and logged) once per version rather than re-read on every message.
+# The size matters because a coarse mtime may not change when a file caught
+# mid-write (truncated, then filled) is completed.
+_BAD_PORT_FILES = {}
+
+def _read_port_bin(port_file):
+    """Read the port from the binary port file"""
+    fd = os.open(port_file, os.O_RDONLY)
+    try:
+        data = os.read(fd, _PORT_BIN.size)
+    finally:
+        os.close(fd)
+    
+    magic, port = _PORT_BIN.unpack(data)
+    if magic != _PORT_BIN_MAGIC:
+        raise ValueError(f"bad magic {magic!r}")
+    return port
+
+def _read_port_json(port_file):
+    """Read the port from the legacy JSON port file"""
+    with open(port_file, 'rb') as f:
+        data = _json.loads(f.read())
+    return data.get('port', 5000)
 
 def get_vscode_port():
     """Read the VS Code extension port from the port file"""
-    port_file = Path.home() / '.bergamot' / 'port.json'
+    port_dir = Path.home() / '.bergamot'
     
-    try:
-        if port_file.exists():
-            with open(port_file, 'r') as f:
-                data = json.load(f)
-                return data.get('port', 5000)
-    except Exception as e:
-        logging.error(f"Error reading port file: {e}")
+    # Prefer the binary port file, falling back to the legacy JSON one
+    for port_file, read_port in ((port_dir / 'port.bin', _read_port_bin),
+                                 (port_dir / 'port.json', _read_port_json)):
+        try:
+            st = os.stat(port_file)
+        except OSError:
+            continue
+        
+        if _PORT_CACHE['path'] == port_file and _PORT_CACHE['mtime'] == st.st_mtime_ns:
+            return _PORT_CACHE['port']
+        if _BAD_PORT_FILES.get(port_file) == (st.st_mtime_ns, st.st_size):
+            continue
+        
+        try:
+            port = read_port(port_file)
+        except Exception as e:
+            _LOG.error(f"Error reading port file {port_file}: {e}")
+            _BAD_PORT_FILES[port_file] = (st.st_mtime_ns, st.st_size)
+            continue
+        
+        _BAD_PORT_FILES.pop(port_file, None)
+        _PORT_CACHE.update(path=port_file, mtime=st.st_mtime_ns, port=port)
+        return port
     
-    # Default to port 5000 if file doesn't exist
+    # Default to port 5000 if no port file can be read
+    _PORT_CACHE['mtime'] = None
     return 5000
 
+def _http():
+    """Return the http.client module, importing it on first use"""
+    global _http_client
+    
+    if _http_client is None:
+        import http.client
+        _http_client = http.client
+    return _http_client
+
+def _get_conn(port):
+    """Return this thread's connection to the VS Code server on the given port"""
+    conn = getattr(_CONNS, 'conn', None)
+    if conn is not None and conn.port == port:
+        return conn
+    
+    if conn is not None:
+        conn.close()
+    conn = _http().HTTPConnection('127.0.0.1', port)
+    _CONNS.conn = conn
+    return conn
+
+def _drop_conn():
+    """Close this thread's connection so the next request reconnects"""
+    conn = getattr(_CONNS, 'conn', None)
+    if conn is not None:
+        conn.close()
+        _CONNS.conn = None
+
+def _request(port, method, endpoint, body=None, timeout=_FORWARD_TIMEOUT):
+    """Send a request to the VS Code server and return (status, body)
+    
+    Raises ConnectionError if the server cannot be reached and TimeoutError
+    (socket.timeout before Python 3.10) if it does not answer within the read
+    timeout.
+    """
+    connect_timeout, read_timeout = timeout
+    headers = {'Connection': 'keep-alive'}
+    if body is not None:
+        headers['Content-Type'] = 'application/json'
+        headers['Content-Length'] = str(len(body))
+    
+    # The server may have closed an idle keep-alive connection since the last
+    # request, so a failure on a reused connection is retried once
+    for attempt in range(2):
+        conn = _get_conn(port)
+        reused = conn.sock is not None
+        
+        if not reused:
+            conn.timeout = connect_timeout
+            try:
+                conn.connect()
+            except OSError as e:
+                _drop_conn()
+                raise ConnectionError(f"Cannot connect to port {port}: {e}") from e
+        conn.sock.settimeout(read_timeout)
+        
+        try:
+            conn.request(method, endpoint, body=body, headers=headers)
+            response = conn.getresponse()
+            content = response.read()
+        except _TIMEOUT_ERRORS:
+            _drop_conn()
+            raise
+        except (ConnectionError, _http().HTTPException):
+            _drop_conn()
+            if reused and attempt == 0:
+                continue
+            raise
+        
+        if response.will_close:
+            _drop_conn()
+        return response.status, content
+
 def forward_to_vscode(message):
     """Forward a message to the VS Code extension HTTP server"""
     port = get_vscode_port()
@@ -83,101 +422,140 @@ def forward_to_vscode(message):
         data = message.get('data', {})
         
         # Make HTTP request to VS Code extension
-        url = f'http://localhost:{port}{endpoint}'
-        logging.info(f"Forwarding to VS Code: {url}")
+        _LOG.info(f"Forwarding to VS Code: http://127.0.0.1:{port}{endpoint}")
         
-        response = requests.post(
-            url,
-            json=data,
-            headers={'Content-Type': 'application/json'},
-            timeout=5
+        status, content = _request(
+            port,
+            'POST',
+            endpoint,
+            body=_json.dumps(data),
+            timeout=_FORWARD_TIMEOUT
         )
         
-        if response.ok:
-            logging.info(f"Successfully forwarded to VS Code")
+        if status < 400:
+            _LOG.info(f"Successfully forwarded to VS Code")
             return {
                 'success': True,
-                'status': response.status_code,
-                'data': response.json() if response.text else None
+                'status': status,
+                'data': _json.loads(content) if content else None
             }
         else:
-            logging.error(f"VS Code returned error: {response.status_code}")
+            _LOG.error(f"VS Code returned error: {status}")
             return {
                 'success': False,
-                'error': f'VS Code returned status {response.status_code}'
+                'error': f'VS Code returned status {status}'
             }
             
-    except requests.exceptions.ConnectionError:
-        logging.error("Cannot connect to VS Code extension")
+    except ConnectionError:
+        _LOG.error("Cannot connect to VS Code extension")
         return {
             'success': False,
             'error': 'Cannot connect to VS Code extension. Is it running?'
         }
-    except requests.exceptions.Timeout:
-        logging.error("Request to VS Code timed out")
+    except _TIMEOUT_ERRORS:
+        _LOG.error("Request to VS Code timed out")
         return {
             'success': False,
             'error': 'Request to VS Code extension timed out'
         }
     except Exception as e:
-        logging.error(f"Error forwarding to VS Code: {e}")
+        _LOG.error(f"Error forwarding to VS Code: {e}")
         return {
             'success': False,
             'error': str(e)
         }
 
+# Pre-encoded start of every pong reply, followed by the echoed data and '}'
+_PONG_PREFIX = b'{"type":"pong","echo":'
+
+# Pool for in-flight forwards, started by the first forward and drained by main()
+_forward_pool = None
+
+def _forward_and_reply(message):
+    """Forward a message to VS Code and send the result back to the browser"""
+    result = forward_to_vscode(message)
+    send_message({'type': 'forward_result', **result})
+
+def _handle_ping(message):
+    # Simple ping/pong for testing; only the echo varies, so splice it in
+    send_message_raw(_PONG_PREFIX + _json.dumps(message.get('data')) + b'}')
+
+def _handle_get_port(message):
+    # Return the current VS Code port
+    port = get_vscode_port()
+    send_message({'type': 'port', 'port': port})
+
+def _handle_forward(message):
+    # Forward message to VS Code extension without blocking the loop. Each
+    # worker keeps its own keep-alive connection to VS Code.
+    global _forward_pool
+    
+    if _forward_pool is None:
+        from concurrent.futures import ThreadPoolExecutor
+        _forward_pool = ThreadPoolExecutor(max_workers=4)
+    _forward_pool.submit(_forward_and_reply, message)
+
+def _handle_check_status(message):
+    # Check if VS Code extension is running
+    port = get_vscode_port()
+    try:
+        status, _ = _request(port, 'GET', '/status', timeout=_STATUS_TIMEOUT)
+        is_running = status < 400
+    except:
+        is_running = False
+    
+    send_message({
+        'type': 'status',
+        'vscode_running': is_running,
+        'port': port
+    })
+
+def _handle_unknown(message):
+    msg_type = message.get('type')
+    _LOG.warning(f"Unknown message type: {msg_type}")
+    send_message({
+        'type': 'error',
+        'error': f'Unknown message type: {msg_type}'
+    })
+
+_HANDLERS = {
+    'ping': _handle_ping,
+    'get_port': _handle_get_port,
+    'forward': _handle_forward,
+    'check_status': _handle_check_status,
+}
+
 def main():
     """Main message loop"""
-    logging.info("Native host started")
+    global _forward_pool
     
-    while True:
-        message = read_message()
-        
-        if not message:
-            logging.error("Invalid message received")
-            continue
-        
-        # Handle different message types
-        msg_type = message.get('type')
-        
-        if msg_type == 'ping':
-            # Simple ping/pong for testing
-            send_message({'type': 'pong', 'echo': message.get('data')})
-            
-        elif msg_type == 'get_port':
-            # Return the current VS Code port
-            port = get_vscode_port()
-            send_message({'type': 'port', 'port': port})
-            
-        elif msg_type == 'forward':
-            # Forward message to VS Code extension
-            result = forward_to_vscode(message)
-            send_message({'type': 'forward_result', **result})
+    _LOG.info("Native host started")
+    
+    try:
+        while True:
+            message = read_message()
             
-        elif msg_type == 'check_status':
-            # Check if VS Code extension is running
-            port = get_vscode_port()
-            try:
-                response = requests.get(f'http://localhost:{port}/status', timeout=2)
-                is_running = response.ok
-            except:
-                is_running = False
+            if not message:
+                _LOG.error("Invalid message received")
+                continue
             
-            send_message({
-                'type': 'status',
-                'vscode_running': is_running,
-                'port': port
-            })
-        else:
-            logging.warning(f"Unknown message type: {msg_type}")
-            send_message({
-                'type': 'error',
-                'error': f'Unknown message type: {msg_type}'
-            })
+            # Handle different message types
+            _HANDLERS.get(message.get('type'), _handle_unknown)(message)
+    finally:
+        # Leaving the loop (e.g. on stdin EOF) waits for in-flight forwards to reply
+        if _forward_pool is not None:
+            _forward_pool.shutdown(wait=True)
+            _forward_pool = None
+        flush_output()
 
 if __name__ == '__main__':
+    # Chrome only passes the caller's origin, so the flag is for manual runs;
+    # browser-launched hosts use BERGAMOT_LOW_LATENCY instead
+    if '--low-latency' in sys.argv[1:]:
+        _low_latency = True
+    
     try:
         main()
     except Exception as e:
-        logging.error(f"Fatal error in native host: {e}")
+        _LOG.error(f"Fatal error in native host: {e}")
         sys.exit(1)
\ No newline at end of file
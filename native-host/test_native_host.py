@@ -4,11 +4,17 @@ Test suite for PKM Assistant Native Messaging Host
 """
 
 import unittest
+import io
 import json
+import http.client
 import struct
 import sys
 import os
+import shutil
+import socket
+import subprocess
 import tempfile
+import threading
 from unittest.mock import patch, MagicMock, mock_open
 from pathlib import Path
 
@@ -18,28 +24,44 @@ sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 # Import the native host module
 import native_host
 
+# Native messaging frame header, as written by the browser
+HDR = struct.Struct('@I')
+
+class ChunkedReader:
+    """A raw stdin stand-in that hands out data in fixed chunks"""
+    
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+    
+    def readinto(self, view):
+        if not self.chunks:
+            return 0
+        chunk = self.chunks.pop(0)
+        view[:len(chunk)] = chunk
+        return len(chunk)
+
+
 class TestNativeHost(unittest.TestCase):
     
     def setUp(self):
         """Set up test fixtures"""
         self.temp_dir = tempfile.mkdtemp()
-        self.port_file = Path(self.temp_dir) / 'port.json'
+        self.port_file = Path(self.temp_dir) / '.bergamot' / 'port.json'
+        self.port_file.parent.mkdir()
         
     def tearDown(self):
         """Clean up test fixtures"""
-        if self.port_file.exists():
-            self.port_file.unlink()
-        os.rmdir(self.temp_dir)
+        shutil.rmtree(self.temp_dir)
     
     def encode_message(self, message):
         """Encode a message in native messaging format"""
         encoded = json.dumps(message).encode('utf-8')
-        length = struct.pack('@I', len(encoded))
+        length = HDR.pack(len(encoded))
         return length + encoded
     
     def decode_message(self, data):
         """Decode a message from native messaging format"""
-        length = struct.unpack('@I', data[:4])[0]
+        length = HDR.unpack(data[:4])[0]
         message = json.loads(data[4:4+length].decode('utf-8'))
         return message
     
@@ -48,28 +70,105 @@ class TestNativeHost(unittest.TestCase):
         test_message = {'type': 'ping', 'data': 'test'}
         encoded = self.encode_message(test_message)
         
-        with patch('sys.stdin.buffer.read') as mock_read:
-            mock_read.side_effect = [encoded[:4], encoded[4:]]
-            
+        with patch.object(native_host, '_STDIN', io.BytesIO(encoded)):
+            result = native_host.read_message()
+            self.assertEqual(result, test_message)
+    
+    def test_read_message_short_reads(self):
+        """Test that a frame split across several reads is reassembled"""
+        test_message = {'type': 'ping', 'data': 'test'}
+        encoded = self.encode_message(test_message)
+        
+        chunks = [encoded[:2], encoded[2:4], encoded[4:10], encoded[10:]]
+        with patch.object(native_host, '_STDIN', ChunkedReader(chunks)):
+            result = native_host.read_message()
+            self.assertEqual(result, test_message)
+    
+    def test_read_message_larger_than_buffer(self):
+        """Test that messages larger than the read buffer are read whole"""
+        test_message = {'type': 'forward', 'data': 'x' * 100000}
+        encoded = self.encode_message(test_message)
+        
+        with patch.object(native_host, '_STDIN', io.BytesIO(encoded)):
             result = native_host.read_message()
             self.assertEqual(result, test_message)
     
+    def test_read_message_eof(self):
+        """Test that closing stdin exits the host"""
+        with patch.object(native_host, '_STDIN', io.BytesIO(b'')):
+            with self.assertRaises(SystemExit):
+                native_host.read_message()
+    
     def test_send_message(self):
         """Test sending a message to stdout"""
         test_message = {'type': 'pong', 'data': 'response'}
         
         with patch('sys.stdout.buffer.write') as mock_write:
             native_host.send_message(test_message)
+            native_host.flush_output()
             
-            # Check that message was written correctly
-            calls = mock_write.call_args_list
-            self.assertEqual(len(calls), 2)  # Length + message
+            # Check that the frame was written in a single call
+            mock_write.assert_called_once()
+            frame = mock_write.call_args[0][0]
             
-            # Verify length header
-            length_bytes = calls[0][0][0]
-            expected_length = len(json.dumps(test_message).encode('utf-8'))
-            actual_length = struct.unpack('@I', length_bytes)[0]
+            # Verify length header and payload
+            expected_length = len(native_host._json.dumps(test_message))
+            actual_length = HDR.unpack(frame[:4])[0]
             self.assertEqual(actual_length, expected_length)
+            self.assertEqual(self.decode_message(frame), test_message)
+    
+    def test_send_message_coalesces_small_messages(self):
+        """Test that small messages are buffered and flushed together"""
+        messages = [{'type': 'pong', 'echo': i} for i in range(3)]
+        
+        # Keep the soft-flush timer out of the way so only the explicit flush writes
+        with patch('sys.stdout.buffer.write') as mock_write, \
+                patch.object(native_host, '_FLUSH_DELAY', 60):
+            for message in messages:
+                native_host.send_message(message)
+            mock_write.assert_not_called()
+            
+            native_host.flush_output()
+            
+            mock_write.assert_called_once()
+            payloads = [native_host._json.dumps(m) for m in messages]
+            expected = b''.join(HDR.pack(len(p)) + p for p in payloads)
+            self.assertEqual(mock_write.call_args[0][0], expected)
+    
+    def test_send_message_flushes_after_delay(self):
+        """Test that buffered messages are flushed by the soft-flush timer"""
+        written = threading.Event()
+        
+        with patch('sys.stdout.buffer.write') as mock_write:
+            mock_write.side_effect = lambda data: written.set()
+            native_host.send_message({'type': 'pong', 'echo': 'test'})
+            
+            self.assertTrue(written.wait(1))
+    
+    def test_send_message_low_latency(self):
+        """Test that low-latency mode writes every message immediately"""
+        with patch('sys.stdout.buffer.write') as mock_write, \
+                patch.object(native_host, '_low_latency', True):
+            native_host.send_message({'type': 'pong', 'echo': 'test'})
+            
+            mock_write.assert_called_once()
+    
+    def test_low_latency_from_environment(self):
+        """Test that BERGAMOT_LOW_LATENCY enables low-latency mode"""
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        
+        code = "import native_host; print(native_host._low_latency)"
+        for value, expected in (('1', 'True'), ('', 'False')):
+            result = subprocess.run(
+                [sys.executable, '-c', code],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                env={**os.environ, 'HOME': temp_dir, 'BERGAMOT_LOW_LATENCY': value},
+                capture_output=True,
+                text=True,
+                check=True
+            )
+            self.assertEqual(result.stdout.strip(), expected)
     
     def test_get_vscode_port_with_file(self):
         """Test getting VS Code port when port file exists"""
@@ -86,15 +185,91 @@ class TestNativeHost(unittest.TestCase):
             port = native_host.get_vscode_port()
             self.assertEqual(port, 5000)  # Default port
     
-    @patch('requests.post')
-    def test_forward_to_vscode_success(self, mock_post):
+    def test_get_vscode_port_binary_file(self):
+        """Test that the binary port file is preferred over port.json"""
+        self.port_file.write_text(json.dumps({'port': 5432}))
+        self.port_file.with_name('port.bin').write_bytes(b'BGP1' + struct.pack('<H', 6543))
+        
+        with patch.object(Path, 'home', return_value=Path(self.temp_dir)):
+            port = native_host.get_vscode_port()
+            self.assertEqual(port, 6543)
+    
+    def test_get_vscode_port_invalid_binary_file(self):
+        """Test falling back to port.json when port.bin is not recognised"""
+        self.port_file.write_text(json.dumps({'port': 5432}))
+        self.port_file.with_name('port.bin').write_bytes(b'XXXX' + struct.pack('<H', 6543))
+        
+        with patch.object(Path, 'home', return_value=Path(self.temp_dir)):
+            port = native_host.get_vscode_port()
+            self.assertEqual(port, 5432)
+    
+    def test_get_vscode_port_invalid_binary_file_read_once(self):
+        """Test that a bad port.bin is not re-read or re-logged until it changes"""
+        port_bin = self.port_file.with_name('port.bin')
+        self.port_file.write_text(json.dumps({'port': 5432}))
+        port_bin.write_bytes(b'BGP1')  # Short read
+        
+        with patch.object(Path, 'home', return_value=Path(self.temp_dir)), \
+                patch.object(native_host._LOG, 'error') as mock_error:
+            self.assertEqual(native_host.get_vscode_port(), 5432)
+            
+            with patch('native_host._read_port_bin') as mock_read_bin, \
+                    patch('builtins.open') as mock_file:
+                for _ in range(3):
+                    self.assertEqual(native_host.get_vscode_port(), 5432)
+                mock_read_bin.assert_not_called()
+                mock_file.assert_not_called()
+            mock_error.assert_called_once()
+            
+            # Fixing port.bin makes it take over again
+            port_bin.write_bytes(b'BGP1' + struct.pack('<H', 6543))
+            os.utime(port_bin, ns=(0, 1))
+            self.assertEqual(native_host.get_vscode_port(), 6543)
+    
+    def test_get_vscode_port_binary_file_completed_with_same_mtime(self):
+        """Test that a port.bin read mid-write is re-read once it is filled in"""
+        port_bin = self.port_file.with_name('port.bin')
+        
+        # Caught between truncation and write: empty file
+        port_bin.write_bytes(b'')
+        os.utime(port_bin, ns=(0, 1))
+        
+        with patch.object(Path, 'home', return_value=Path(self.temp_dir)):
+            self.assertEqual(native_host.get_vscode_port(), 5000)
+            
+            # The write lands within the same coarse timestamp tick
+            port_bin.write_bytes(b'BGP1' + struct.pack('<H', 6543))
+            os.utime(port_bin, ns=(0, 1))
+            self.assertEqual(native_host.get_vscode_port(), 6543)
+    
+    def test_get_vscode_port_cached_until_file_changes(self):
+        """Test that the port file is only re-parsed when its mtime changes"""
+        self.port_file.write_text(json.dumps({'port': 5432}))
+        
+        with patch.object(Path, 'home', return_value=Path(self.temp_dir)):
+            self.assertEqual(native_host.get_vscode_port(), 5432)
+            
+            with patch('builtins.open') as mock_file:
+                self.assertEqual(native_host.get_vscode_port(), 5432)
+                mock_file.assert_not_called()
+            
+            self.port_file.write_text(json.dumps({'port': 6543}))
+            os.utime(self.port_file, ns=(0, 1))
+            self.assertEqual(native_host.get_vscode_port(), 6543)
+    
+    def mock_connection(self, status=200, body=b''):
+        """Create a connected HTTPConnection stand-in returning one response"""
+        mock_conn = MagicMock()
+        mock_conn.getresponse.return_value.status = status
+        mock_conn.getresponse.return_value.read.return_value = body
+        mock_conn.getresponse.return_value.will_close = False
+        return mock_conn
+    
+    @patch('native_host._get_conn')
+    def test_forward_to_vscode_success(self, mock_get_conn):
         """Test successful forwarding to VS Code"""
-        mock_response = MagicMock()
-        mock_response.ok = True
-        mock_response.status_code = 200
-        mock_response.json.return_value = {'result': 'success'}
-        mock_response.text = '{"result": "success"}'
-        mock_post.return_value = mock_response
+        mock_conn = self.mock_connection(200, b'{"result": "success"}')
+        mock_get_conn.return_value = mock_conn
         
         message = {
             'endpoint': '/visit',
@@ -107,18 +282,47 @@ class TestNativeHost(unittest.TestCase):
         self.assertEqual(result['status'], 200)
         self.assertEqual(result['data'], {'result': 'success'})
         
-        mock_post.assert_called_once_with(
-            'http://localhost:5000/visit',
-            json={'url': 'https://example.com'},
-            headers={'Content-Type': 'application/json'},
-            timeout=5
+        body = native_host._json.dumps({'url': 'https://example.com'})
+        mock_get_conn.assert_called_once_with(5000)
+        mock_conn.sock.settimeout.assert_called_once_with(5.0)
+        mock_conn.request.assert_called_once_with(
+            'POST',
+            '/visit',
+            body=body,
+            headers={
+                'Connection': 'keep-alive',
+                'Content-Type': 'application/json',
+                'Content-Length': str(len(body))
+            }
         )
     
-    @patch('requests.post')
-    def test_forward_to_vscode_connection_error(self, mock_post):
+    @patch('native_host._get_conn')
+    def test_forward_to_vscode_empty_response(self, mock_get_conn):
+        """Test forwarding when VS Code replies with an empty body"""
+        mock_get_conn.return_value = self.mock_connection(204, b'')
+        
+        result = native_host.forward_to_vscode({'endpoint': '/visit', 'data': {}})
+        
+        self.assertTrue(result['success'])
+        self.assertIsNone(result['data'])
+    
+    @patch('native_host._get_conn')
+    def test_forward_to_vscode_error_status(self, mock_get_conn):
+        """Test forwarding when VS Code returns an error status"""
+        mock_get_conn.return_value = self.mock_connection(500)
+        
+        result = native_host.forward_to_vscode({'endpoint': '/visit', 'data': {}})
+        
+        self.assertFalse(result['success'])
+        self.assertIn('500', result['error'])
+    
+    @patch('native_host._get_conn')
+    def test_forward_to_vscode_connection_error(self, mock_get_conn):
         """Test forwarding when VS Code is not running"""
-        import requests
-        mock_post.side_effect = requests.exceptions.ConnectionError()
+        mock_conn = self.mock_connection()
+        mock_conn.sock = None
+        mock_conn.connect.side_effect = ConnectionRefusedError()
+        mock_get_conn.return_value = mock_conn
         
         message = {
             'endpoint': '/visit',
@@ -129,38 +333,62 @@ class TestNativeHost(unittest.TestCase):
         
         self.assertFalse(result['success'])
         self.assertIn('Cannot connect', result['error'])
+        self.assertEqual(mock_conn.timeout, 0.25)
     
-    @patch('requests.post')
-    def test_forward_to_vscode_timeout(self, mock_post):
+    @patch('native_host._get_conn')
+    def test_forward_to_vscode_timeout(self, mock_get_conn):
         """Test forwarding timeout"""
-        import requests
-        mock_post.side_effect = requests.exceptions.Timeout()
+        mock_conn = self.mock_connection()
+        mock_conn.getresponse.side_effect = socket.timeout('timed out')
+        mock_get_conn.return_value = mock_conn
         
         message = {
             'endpoint': '/visit',
             'data': {'url': 'https://example.com'}
         }
         
-        result = native_host.forward_to_vscode(message)
+        with patch('native_host._drop_conn') as mock_drop_conn:
+            result = native_host.forward_to_vscode(message)
         
         self.assertFalse(result['success'])
-        self.assertIn('timed out', result['error'])
+        self.assertEqual(result['error'], 'Request to VS Code extension timed out')
+        
+        # The connection still has a request outstanding, so it must not be reused
+        mock_drop_conn.assert_called_once()
     
-    @patch('native_host.send_message')
+    @patch('native_host._get_conn')
+    def test_forward_to_vscode_retries_stale_connection(self, mock_get_conn):
+        """Test that a keep-alive connection closed by VS Code is replaced"""
+        stale_conn = self.mock_connection()
+        stale_conn.getresponse.side_effect = http.client.RemoteDisconnected()
+        
+        fresh_conn = self.mock_connection(200, b'{"result": "ok"}')
+        fresh_conn.sock = None
+        fresh_conn.connect.side_effect = lambda: setattr(fresh_conn, 'sock', MagicMock())
+        mock_get_conn.side_effect = [stale_conn, fresh_conn]
+        
+        result = native_host.forward_to_vscode({'endpoint': '/visit', 'data': {}})
+        
+        self.assertTrue(result['success'])
+        self.assertEqual(result['data'], {'result': 'ok'})
+        fresh_conn.connect.assert_called_once()
+    
+    @patch('native_host.send_message_raw')
     @patch('native_host.read_message')
     def test_main_ping_pong(self, mock_read, mock_send):
         """Test ping/pong message handling"""
         mock_read.side_effect = [
             {'type': 'ping', 'data': 'test'},
-            None  # Exit loop
+            SystemExit(0)  # stdin EOF exits the loop
         ]
         
-        # Run main loop (will exit on None)
+        # Run main loop (will exit on EOF)
         with self.assertRaises(SystemExit):
             native_host.main()
         
         # Check that pong was sent
-        mock_send.assert_called_with({
+        mock_send.assert_called_once()
+        self.assertEqual(json.loads(mock_send.call_args[0][0]), {
             'type': 'pong',
             'echo': 'test'
         })
@@ -173,10 +401,10 @@ class TestNativeHost(unittest.TestCase):
         mock_get_port.return_value = 5432
         mock_read.side_effect = [
             {'type': 'get_port'},
-            None  # Exit loop
+            SystemExit(0)  # stdin EOF exits the loop
         ]
         
-        # Run main loop (will exit on None)
+        # Run main loop (will exit on EOF)
         with self.assertRaises(SystemExit):
             native_host.main()
         
@@ -203,10 +431,10 @@ class TestNativeHost(unittest.TestCase):
                 'endpoint': '/visit',
                 'data': {'url': 'https://example.com'}
             },
-            None  # Exit loop
+            SystemExit(0)  # stdin EOF exits the loop
         ]
         
-        # Run main loop (will exit on None)
+        # Run main loop (will exit on EOF)
         with self.assertRaises(SystemExit):
             native_host.main()
         
@@ -219,21 +447,49 @@ class TestNativeHost(unittest.TestCase):
             'data': {'result': 'ok'}
         })
     
+    @patch('native_host.send_message_raw')
+    @patch('native_host.read_message')
+    @patch('native_host.forward_to_vscode')
+    def test_main_forward_does_not_block_loop(self, mock_forward, mock_read, mock_send):
+        """Test that later messages are handled while a forward is in flight"""
+        release = threading.Event()
+        
+        def slow_forward(message):
+            release.wait(5)
+            return {'success': True, 'status': 200, 'data': None}
+        
+        def pong_then_release(encoded):
+            if json.loads(encoded)['type'] == 'pong':
+                release.set()
+        
+        mock_forward.side_effect = slow_forward
+        mock_send.side_effect = pong_then_release
+        mock_read.side_effect = [
+            {'type': 'forward', 'endpoint': '/visit', 'data': {}},
+            {'type': 'ping', 'data': 'test'},
+            SystemExit(0)  # stdin EOF exits the loop
+        ]
+        
+        with self.assertRaises(SystemExit):
+            native_host.main()
+        
+        # The pong overtook the forward, which still replied before exit
+        sent_types = [json.loads(c[0][0])['type'] for c in mock_send.call_args_list]
+        self.assertEqual(sent_types, ['pong', 'forward_result'])
+    
     @patch('native_host.send_message')
     @patch('native_host.read_message')
-    @patch('requests.get')
-    def test_main_check_status(self, mock_get, mock_read, mock_send):
+    @patch('native_host._get_conn')
+    def test_main_check_status(self, mock_get_conn, mock_read, mock_send):
         """Test check_status message handling"""
-        mock_response = MagicMock()
-        mock_response.ok = True
-        mock_get.return_value = mock_response
+        mock_get_conn.return_value = self.mock_connection(200)
         
         mock_read.side_effect = [
             {'type': 'check_status'},
-            None  # Exit loop
+            SystemExit(0)  # stdin EOF exits the loop
         ]
         
-        # Run main loop (will exit on None)
+        # Run main loop (will exit on EOF)
         with self.assertRaises(SystemExit):
             native_host.main()
         
@@ -250,10 +506,10 @@ class TestNativeHost(unittest.TestCase):
         """Test handling of unknown message type"""
         mock_read.side_effect = [
             {'type': 'unknown_type'},
-            None  # Exit loop
+            SystemExit(0)  # stdin EOF exits the loop
         ]
         
-        # Run main loop (will exit on None)
+        # Run main loop (will exit on EOF)
         with self.assertRaises(SystemExit):
             native_host.main()
         
@@ -264,42 +520,119 @@ class TestNativeHost(unittest.TestCase):
         })
 
 
+class TestFastLog(unittest.TestCase):
+    """Tests for the native host's buffered logger"""
+    
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.log_file = Path(self.temp_dir) / 'native-host.log'
+    
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+    
+    def test_level_filtering(self):
+        """Test that records below the configured level are dropped"""
+        log = native_host.FastLog(self.log_file, level=native_host.FastLog.INFO)
+        log.debug("hidden %s", 'debug')
+        log.info("shown %s", 'info')
+        log.error("shown error")
+        log.flush()
+        
+        lines = self.log_file.read_text().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].endswith(' I shown info'))
+        self.assertTrue(lines[1].endswith(' E shown error'))
+        log.f.close()
+    
+    def test_rotation(self):
+        """Test that the log is rotated once it exceeds max_bytes"""
+        log = native_host.FastLog(self.log_file, max_bytes=64)
+        for i in range(10):
+            log.info("record %d", i)
+        log.flush()
+        
+        backup = self.log_file.with_name('native-host.log.1')
+        self.assertTrue(backup.exists())
+        self.assertLess(self.log_file.stat().st_size, 64)
+        log.f.close()
+    
+    def test_rotation_failure_keeps_logging(self):
+        """Test that a failed rotation (file held open elsewhere) is not raised"""
+        log = native_host.FastLog(self.log_file, max_bytes=64)
+        with patch('os.replace', side_effect=PermissionError()):
+            for i in range(10):
+                log.info("record %d", i)
+        log.flush()
+        
+        self.assertFalse(self.log_file.with_name('native-host.log.1').exists())
+        self.assertEqual(len(self.log_file.read_text().splitlines()), 10)
+        log.f.close()
+    
+    def test_write_errors_do_not_reach_callers(self):
+        """Test that a failing log file does not break message handling"""
+        disk_full = OSError(28, 'No space left on device')
+        
+        with patch.object(native_host._LOG.f, 'write', side_effect=disk_full), \
+                patch.object(native_host._LOG.f, 'flush', side_effect=disk_full):
+            # A bad frame logs an error, which flushes immediately
+            with patch.object(native_host, '_STDIN', io.BytesIO(HDR.pack(3) + b'bad')):
+                self.assertIsNone(native_host.read_message())
+            
+            with patch('sys.stdout.buffer.write'), \
+                    patch.object(native_host, '_low_latency', True):
+                self.assertIsNone(native_host.send_message({'type': 'pong'}))
+            
+            native_host._LOG.flush()
+
+
 class TestIntegration(unittest.TestCase):
     """Integration tests for the native host"""
     
-    @patch('sys.stdout.buffer')
-    @patch('sys.stdin.buffer')
-    def test_full_message_flow(self, mock_stdin, mock_stdout):
+    def test_http_client_imported_lazily(self):
+        """Test that starting the host does not import http.client"""
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        
+        code = "import sys, native_host; print('http.client' in sys.modules)"
+        result = subprocess.run(
+            [sys.executable, '-c', code],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            env={**os.environ, 'HOME': temp_dir},
+            capture_output=True,
+            text=True,
+            check=True
+        )
+        self.assertEqual(result.stdout.strip(), 'False')
+    
+    @patch('sys.stdout')
+    def test_full_message_flow(self, mock_stdout):
         """Test complete message flow through the native host"""
         # Prepare input message
         input_message = {'type': 'ping', 'data': 'integration_test'}
         encoded_input = json.dumps(input_message).encode('utf-8')
-        length_header = struct.pack('@I', len(encoded_input))
+        length_header = HDR.pack(len(encoded_input))
         
-        # Setup stdin to provide the message then exit
-        mock_stdin.read.side_effect = [
-            length_header,
-            encoded_input,
-            b''  # EOF to exit
-        ]
+        # Setup stdin to provide the message then EOF to exit
+        stdin = io.BytesIO(length_header + encoded_input)
         
         # Capture output
         output_buffer = []
-        mock_stdout.write.side_effect = lambda x: output_buffer.append(x)
-        mock_stdout.flush.return_value = None
+        mock_stdout.buffer.write.side_effect = lambda x: output_buffer.append(x)
+        mock_stdout.buffer.flush.return_value = None
         
         # Run the main loop
         try:
-            native_host.main()
+            with patch.object(native_host, '_STDIN', stdin):
+                native_host.main()
         except SystemExit:
             pass  # Expected when stdin returns empty
         
         # Verify output
-        self.assertEqual(len(output_buffer), 2)  # Length + message
+        self.assertEqual(len(output_buffer), 1)  # Length + message in one write
         
         # Decode output message
-        output_length = struct.unpack('@I', output_buffer[0])[0]
-        output_message = json.loads(output_buffer[1].decode('utf-8'))
+        output_length = HDR.unpack(output_buffer[0][:4])[0]
+        output_message = json.loads(output_buffer[0][4:4+output_length].decode('utf-8'))
         
         # Verify pong response
         self.assertEqual(output_message['type'], 'pong')
@@ -89,6 +89,21 @@ describe('ServerManager', () => {
       );
     });
 
+    it('should write binary port file for the native host', async () => {
+      const mock_write_file_sync = fs.writeFileSync as jest.Mock;
+      mock_write_file_sync.mockImplementation(() => {});
+
+      const port = await server_manager.start();
+
+      const expected_record = Buffer.alloc(6);
+      expected_record.write('BGP1', 0, 'ascii');
+      expected_record.writeUInt16LE(port, 4);
+      expect(mock_write_file_sync).toHaveBeenCalledWith(
+        path.join(os.homedir(), '.bergamot', 'port.bin'),
+        expected_record
+      );
+    });
+
     it('should start queue processor', async () => {
       await server_manager.start();
 
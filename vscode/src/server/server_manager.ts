@@ -185,6 +185,8 @@ export class ServerManager {
   /**
    * Writes the server port to a file for the native messaging host.
    * This allows the browser extension to discover the server's dynamic port.
+   * The native host reads ~/.bergamot/port.bin: the 'BGP1' magic followed by
+   * the port as a little-endian uint16.
    * 
    * @param port - The port number to write
    * @private
@@ -193,6 +195,17 @@ export class ServerManager {
     const port_file_path = path.join(os.tmpdir(), 'pkm_assistant_port.txt');
     fs.writeFileSync(port_file_path, port.toString());
     console.log(`Port written to ${port_file_path}`);
+
+    const native_port_file_path = path.join(os.homedir(), '.bergamot', 'port.bin');
+    const port_record = Buffer.alloc(6);
+    port_record.write('BGP1', 0, 'ascii');
+    port_record.writeUInt16LE(port, 4);
+    try {
+      fs.mkdirSync(path.dirname(native_port_file_path), { recursive: true });
+      fs.writeFileSync(native_port_file_path, port_record);
+    } catch (error) {
+      console.error(`Failed to write ${native_port_file_path}:`, error);
+    }
   }
 
   /**